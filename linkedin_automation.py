@@ -3,12 +3,18 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.action_chains import ActionChains
+from selenium.common.exceptions import (
+    ElementClickInterceptedException, StaleElementReferenceException, TimeoutException
+)
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
+import asyncio
+import concurrent.futures
+from contextlib import asynccontextmanager
 import logging
-import json
 import os
-import time
+import threading
 
 # Setup logging to track what's happening
 logging.basicConfig(
@@ -21,8 +27,93 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# How many browsers to keep warm for parallel requests
+POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "3"))
+
+# How long chromedriver keeps polling for an element before giving up
+IMPLICIT_WAIT = 10
+
+# Fail fast on slow pages/scripts instead of hogging a browser for Selenium's 300s default
+PAGE_LOAD_TIMEOUT = 15
+SCRIPT_TIMEOUT = 10
+
+# Stuff the automations never look at - images, fonts and tracking calls
+_BLOCKED_URLS = [
+    "*.jpg", "*.png", "*.gif", "*.woff2",
+    "*platform.linkedin.com/li/track*", "*collect?*",
+]
+
+# Where the connect button might be hiding (CSS first, it's a lot quicker than XPath text matching)
+_CONNECT_SELECTORS = (
+    (By.CSS_SELECTOR, "button[aria-label^='Invite'][aria-label*='to connect']"),
+    (By.CSS_SELECTOR, "button[class*='connect-button']"),
+    (By.XPATH, "//button[contains(text(), 'Connect')]"),
+)
+
+# Fallback when Connect is tucked away in the "More actions" dropdown
+_MORE_ACTIONS_BTN = (By.CSS_SELECTOR, "button[aria-label='More actions']")
+_OPEN_DROPDOWN = (By.CSS_SELECTOR, "div.artdeco-dropdown__content:not([aria-hidden='true'])")
+_DROPDOWN_CONNECT = (By.XPATH, ".//span[contains(text(), 'Connect')]")
+
+# Signs that we're already connected to a profile
+_CONNECTED_INDICATORS = (
+    (By.CSS_SELECTOR, "[aria-label*='1st degree']"),
+    (By.CSS_SELECTOR, "button[aria-label^='Message']"),
+    (By.XPATH, "//span[contains(@class, 'connection-status') and contains(text(), 'Connected')]"),
+)
+
+# Checks every indicator in the page itself so it's one round-trip instead of one per selector
+_CONNECTED_SCRIPT = '''
+    return arguments[0].some(([by, sel]) => by === 'xpath'
+        ? document.evaluate(sel, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue !== null
+        : document.querySelector(sel) !== null);
+'''
+
+# Fills and submits the login form in one go (native setter so React notices the change)
+_LOGIN_SCRIPT = '''
+    const fill = (el, value) => {
+        Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set.call(el, value);
+        el.dispatchEvent(new Event('input', {bubbles: true}));
+    };
+    fill(document.getElementById('username'), arguments[0]);
+    fill(document.getElementById('password'), arguments[1]);
+    document.querySelector("button[type='submit']").click();
+'''
+
+# Watches for whichever invite modal LinkedIn shows and clicks send, polling in the page itself
+_SEND_INVITE_SCRIPT = '''
+    const done = arguments[arguments.length - 1];
+    const start = Date.now();
+    (function tick() {
+        const send = document.querySelector(
+            "button[aria-label^='Send now'], button[aria-label='Send without a note']"
+        );
+        if (send) {
+            send.click();
+            return done('sent');
+        }
+        if (Date.now() - start > 5000) return done('timeout');
+        setTimeout(tick, 100);
+    })();
+'''
+
+@asynccontextmanager
+async def lifespan(app):
+    # Selenium calls block, so they all run on this executor instead of the event loop
+    app.state.executor = concurrent.futures.ThreadPoolExecutor(max_workers=pool.size)
+    try:
+        await pool.start(app.state.executor)
+        yield
+    finally:
+        # Quit the browsers first, a Chrome left running keeps its profile locked for next time
+        try:
+            await runSync(closeSync, pool.managers)
+        except HTTPException:
+            pass  # closeSync already logged it
+        app.state.executor.shutdown(wait=False)
+
 # FastAPI app setup
-app = FastAPI(title="LinkedIn Automation Service")
+app = FastAPI(title="LinkedIn Automation Service", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Models for request data
 class LoginCredentials(BaseModel):
@@ -36,22 +127,48 @@ class SendMessage(BaseModel):
     profileLink: str
     messageText: str
 
+# uc patches the driver binary on start, so only one browser may start at a time
+_start_lock = threading.Lock()
+
 # Manage browser sessions
 class BrowserManager:
-    def __init__(self):
+    def __init__(self, manager_id=0):
+        self.manager_id = manager_id
         self.browser = None
-        self.session_file = "cookies.json"
+        # Each browser keeps its own Chrome profile (session, cache) between restarts
+        self.profile_dir = os.path.abspath(f"./chrome_profile_{manager_id}")
+        self.logged_in = False
+        # Whose LinkedIn session this browser holds, so we never hand one account's session to another
+        self.account = None
+        # Which selector worked last time, per lookup - LinkedIn's layout rarely changes mid-session
+        self._selector_hits = {}
     
     def startBrowser(self):
         # Let's get a stealthy browser going
+        with _start_lock:
+            self._startBrowser()
+    
+    def _startBrowser(self):
         try:
             chrome_options = uc.ChromeOptions()
             chrome_options.add_argument('--disable-blink-features=AutomationControlled')
             chrome_options.add_argument('--no-sandbox')
             chrome_options.add_argument('--disable-dev-shm-usage')
-            chrome_options.add_argument('--start-maximized')
+            # Headless needs an explicit desktop-sized window so we get the desktop layout
+            chrome_options.add_argument('--window-size=1920,1080')
+            chrome_options.add_argument('--disable-gpu')
+            chrome_options.add_argument('--disable-software-rasterizer')
+            chrome_options.add_argument(f'--user-data-dir={self.profile_dir}')
+            chrome_options.add_argument('--disk-cache-size=104857600')
+            # Hand control back at DOMContentLoaded, we don't need every tracker to finish
+            chrome_options.page_load_strategy = 'eager'
             
-            self.browser = uc.Chrome(options=chrome_options, headless=False)
+            # uc adds --headless=new for us on modern Chrome
+            self.browser = uc.Chrome(options=chrome_options, headless=True, keep_alive=True)
+            # Let chromedriver do the polling for us instead of round-tripping every 500ms
+            self.browser.implicitly_wait(IMPLICIT_WAIT)
+            self.browser.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+            self.browser.set_script_timeout(SCRIPT_TIMEOUT)
             # Sneaky trick to hide automation
             self.browser.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {
                 'source': '''
@@ -60,127 +177,181 @@ class BrowserManager:
                     })
                 '''
             })
-            logger.info("Browser started, ready to roll!")
+            # Don't download what we won't use, and keep the disk cache on for the rest
+            self.browser.execute_cdp_cmd('Network.enable', {})
+            self.browser.execute_cdp_cmd('Network.setBlockedURLs', {'urls': _BLOCKED_URLS})
+            self.browser.execute_cdp_cmd('Network.setCacheDisabled', {'cacheDisabled': False})
+            logger.info(f"Browser {self.manager_id} started, ready to roll!")
         except Exception as e:
             logger.error(f"Oops, browser failed to start: {str(e)}")
             raise HTTPException(status_code=500, detail="Couldn't start the browser!")
     
-    def saveCookies(self):
-        # Save cookies to keep session alive
+    def clearSession(self):
+        # Log out by wiping every cookie in the profile (not just the current page's domain)
         if self.browser:
-            cookies = self.browser.get_cookies()
-            with open(self.session_file, 'w') as file:
-                json.dump(cookies, file)
-            logger.info("Cookies saved to file")
-    
-    def loadCookies(self):
-        # Load cookies to restore session
-        if os.path.exists(self.session_file) and self.browser:
-            with open(self.session_file, 'r') as file:
-                cookies = json.load(file)
-            for cookie in cookies:
-                self.browser.add_cookie(cookie)
-            logger.info("Loaded cookies from file")
+            self.browser.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        self.logged_in = False
+        self.account = None
     
     def shutdown(self):
-        # Clean up browser
+        # Clean up browser, and the LinkedIn session kept in its profile
         if self.browser:
+            self.clearSession()
             self.browser.quit()
             self.browser = None
-            if os.path.exists(self.session_file):
-                os.remove(self.session_file)
             logger.info("Browser closed, all clean")
 
-# Global browser instance
-browser_mgr = BrowserManager()
+# Keep a few browsers warm so requests don't have to wait on each other
+class BrowserPool:
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self.managers = [BrowserManager(i) for i in range(size)]
+        self._queue = None
+        self._all_lock = None
+    
+    async def start(self, executor=None):
+        # Fire up the browsers (one at a time, see _start_lock), then hand them out
+        self._queue = asyncio.Queue()
+        self._all_lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        for mgr in self.managers:
+            try:
+                await loop.run_in_executor(executor, mgr.startBrowser)
+            except HTTPException:
+                pass  # Login will try again
+            self._queue.put_nowait(mgr)
+        logger.info(f"Browser pool ready with {self.size} browsers")
+    
+    async def acquire(self):
+        return await self._queue.get()
+    
+    def release(self, mgr):
+        self._queue.put_nowait(mgr)
+    
+    async def acquireAll(self):
+        # Grab every browser (for login/close), one caller at a time so we don't deadlock
+        async with self._all_lock:
+            return [await self._queue.get() for _ in range(self.size)]
+
+# Global browser pool
+pool = BrowserPool()
 
-def waitForElement(driver, by, value, timeout=10):
-    # Wait for element to show up
+async def runSync(func, *args):
+    # Hand blocking Selenium work to the executor
+    return await asyncio.get_running_loop().run_in_executor(app.state.executor, func, *args)
+
+def waitForElement(driver, by, value, condition=None, timeout=10):
+    # Wait for element to show up - the implicit wait handles plain lookups,
+    # only fancier conditions need an explicit WebDriverWait
     try:
-        element = WebDriverWait(driver, timeout).until(
-            EC.presence_of_element_located((by, value))
-        )
-        return element
+        if condition is None:
+            return driver.find_element(by, value)
+        driver.implicitly_wait(0)
+        try:
+            return WebDriverWait(driver, timeout).until(condition((by, value)))
+        finally:
+            driver.implicitly_wait(IMPLICIT_WAIT)
     except:
         logger.error(f"Couldn't find element: {value}")
         raise HTTPException(status_code=404, detail=f"Element {value} not found")
 
-def findConnectBtn(driver):
-    # Try different ways to find the connect button
-    possible_selectors = [
-        "//button[contains(@aria-label, 'Invite') and contains(@aria-label, 'to connect')]",
-        "//button[contains(text(), 'Connect')]",
-        "//button[contains(@class, 'connect-button')]"
-    ]
-    
-    for selector in possible_selectors:
-        try:
-            button = waitForElement(driver, By.XPATH, selector)
-            if button.is_displayed():
-                return button
-        except:
-            continue
+def _rotated(locators, start):
+    # Same locators, starting from the one at `start`
+    return locators[start:] + locators[:start]
+
+def _firstPresent(driver, locators, hits=None, key=None):
+    # First visible match, or None. Callers turn the implicit wait off first, otherwise
+    # every missing selector blocks for the full IMPLICIT_WAIT.
+    # With `hits`, start from whichever locator matched last time and remember the new winner
+    start = hits.get(key, 0) if hits is not None else 0
+    for offset, (by, selector) in enumerate(_rotated(locators, start)):
+        elements = driver.find_elements(by, selector)
+        if elements and elements[0].is_displayed():
+            if hits is not None:
+                hits[key] = (start + offset) % len(locators)
+            return elements[0]
+    return None
+
+def openPage(driver, url):
+    # Go to a page; if it's still loading junk after the timeout, stop it and carry on
+    try:
+        driver.get(url)
+    except TimeoutException:
+        logger.info(f"Page load timed out, using what we have: {url}")
+        driver.execute_script("window.stop();")
+
+def clickElement(driver, element):
+    # Plain click is one command; only move the mouse over if something's in the way
+    try:
+        element.click()
+    except ElementClickInterceptedException:
+        ActionChains(driver).move_to_element(element).click().perform()
+
+def findConnectBtn(driver, hits=None):
+    # Try different ways to find the connect button (retry briefly, the eager load
+    # can hand us the page before the profile card has rendered, so buttons may go stale)
+    driver.implicitly_wait(0)
+    try:
+        return WebDriverWait(
+            driver, 3, poll_frequency=0.25, ignored_exceptions=(StaleElementReferenceException,)
+        ).until(lambda d: _firstPresent(d, _CONNECT_SELECTORS, hits, 'connect'))
+    except TimeoutException:
+        pass
+    finally:
+        driver.implicitly_wait(IMPLICIT_WAIT)
     
     # Maybe it's in a dropdown?
     try:
-        more_btn = waitForElement(driver, By.XPATH, "//button[@aria-label='More actions']")
+        more_btn = waitForElement(driver, *_MORE_ACTIONS_BTN)
         more_btn.click()
-        time.sleep(1)  # Give it a sec
-        connect_option = waitForElement(driver, By.XPATH, "//div[contains(@class, 'artdeco-dropdown')]//span[contains(text(), 'Connect')]")
+        # Wait just until the dropdown opens, then look inside it
+        dropdown = waitForElement(driver, *_OPEN_DROPDOWN, EC.visibility_of_element_located, timeout=5)
+        connect_option = dropdown.find_element(*_DROPDOWN_CONNECT)
         return connect_option
     except:
         logger.error("No connect button found!")
         raise HTTPException(status_code=404, detail="Connect button not found")
 
 def checkIfConnected(driver):
-    # Check if we're connected to this profile
-    indicators = [
-        "//span[contains(text(), '1st')]",
-        "//button[contains(text(), 'Message')]",
-        "//span[contains(@class, 'connection-status') and contains(text(), 'Connected')]"
-    ]
-    
-    for indicator in indicators:
-        try:
-            waitForElement(driver, By.XPATH, indicator, timeout=5)
-            return True
-        except:
-            continue
-    return False
+    # Check if we're connected to this profile (retry briefly while the page renders)
+    try:
+        return WebDriverWait(driver, 3, poll_frequency=0.25).until(
+            lambda d: d.execute_script(_CONNECTED_SCRIPT, _CONNECTED_INDICATORS)
+        )
+    except TimeoutException:
+        return False
 
-@app.post("/login")
-async def doLogin(creds: LoginCredentials):
+def loginSync(browser_mgr, creds):
     # Login to LinkedIn
     try:
-        if not browser_mgr.browser:
-            browser_mgr.startBrowser()
-        
-        browser_mgr.browser.get("https://www.linkedin.com/login")
-        browser_mgr.loadCookies()
-        
-        # Already logged in?
-        if "feed" in browser_mgr.browser.current_url:
+        # Skip the trip to the login page if we know the session is live for this account
+        if browser_mgr.logged_in and browser_mgr.browser and browser_mgr.account == creds.email:
             logger.info("We're already logged in!")
             return {"status": "ok", "message": "Already logged in"}
         
-        # Fill in login form
-        username_field = waitForElement(browser_mgr.browser, By.ID, "username")
-        username_field.clear()
-        username_field.send_keys(creds.email)
+        if not browser_mgr.browser:
+            browser_mgr.startBrowser()
         
-        password_field = waitForElement(browser_mgr.browser, By.ID, "password")
-        password_field.clear()
-        password_field.send_keys(creds.passwd)
+        driver = browser_mgr.browser
+        # Any session left in the profile (another account, or a previous run) was never
+        # checked against these credentials, so start clean
+        browser_mgr.clearSession()
+        openPage(driver, "https://www.linkedin.com/login")
         
-        submit_btn = waitForElement(browser_mgr.browser, By.XPATH, "//button[@type='submit']")
-        submit_btn.click()
+        # Fill in login form
+        driver.execute_script(_LOGIN_SCRIPT, creds.email, creds.passwd)
         
-        # Wait for dashboard
-        WebDriverWait(browser_mgr.browser, 15).until(
-            EC.url_contains("feed")
-        )
+        # Wait for dashboard (no implicit wait while we poll, so they don't stack up)
+        driver.implicitly_wait(0)
+        try:
+            WebDriverWait(driver, 15).until(
+                EC.url_contains("feed")
+            )
+        finally:
+            driver.implicitly_wait(IMPLICIT_WAIT)
         
-        browser_mgr.saveCookies()
+        browser_mgr.logged_in = True
+        browser_mgr.account = creds.email
         logger.info(f"Logged in as {creds.email}")
         return {"status": "ok", "message": "Logged in successfully"}
     
@@ -188,28 +359,48 @@ async def doLogin(creds: LoginCredentials):
         logger.error(f"Login failed: {str(e)}")
         raise HTTPException(status_code=400, detail="Login didn't work, check credentials")
 
-@app.post("/connect")
-async def sendConnect(request: ConnectProfile):
+@app.post("/login")
+async def doLogin(creds: LoginCredentials):
+    # Every browser in the pool needs its own session - log them in one at a time
+    # so LinkedIn doesn't see the same credentials N times at once
+    managers = await pool.acquireAll()
+    results = {}
+    try:
+        for mgr in managers:
+            try:
+                results[mgr.manager_id] = await runSync(loginSync, mgr, creds)
+            except HTTPException as e:
+                results[mgr.manager_id] = e
+    finally:
+        for mgr in managers:
+            pool.release(mgr)
+    
+    failed = [mgr_id for mgr_id, result in results.items() if isinstance(result, HTTPException)]
+    if len(failed) == len(results):
+        raise HTTPException(status_code=400, detail="Login didn't work, check credentials")
+    if failed:
+        logger.error(f"Login failed for browsers {failed}")
+        return {"status": "partial", "message": "Logged in on some browsers", "failed": failed}
+    return next(iter(results.values()))
+
+def connectSync(browser_mgr, request):
     # Send a connection request
     try:
-        if not browser_mgr.browser:
+        if not browser_mgr.browser or not browser_mgr.logged_in:
             raise HTTPException(status_code=400, detail="Need to login first!")
         
-        browser_mgr.browser.get(request.profileLink)
-        connect_button = findConnectBtn(browser_mgr.browser)
+        driver = browser_mgr.browser
+        openPage(driver, request.profileLink)
+        connect_button = findConnectBtn(driver, browser_mgr._selector_hits)
         
-        # Click with some flair
-        actions = ActionChains(browser_mgr.browser)
-        actions.move_to_element(connect_button).click().perform()
+        clickElement(driver, connect_button)
         
-        # Handle any confirmation pop-up
-        try:
-            send_btn = waitForElement(browser_mgr.browser, By.XPATH, "//button[contains(@aria-label, 'Send now')]", timeout=5)
-            send_btn.click()
-        except:
-            pass  # Sometimes no confirmation needed
+        # Handle any confirmation pop-up ("Send now" or the "Add a note?" one)
+        if driver.execute_async_script(_SEND_INVITE_SCRIPT) == 'timeout':
+            # Could be sent straight away, or stuck on a modal we don't know (email check etc.)
+            logger.warning(f"Clicked Connect but couldn't confirm the invite for {request.profileLink}")
+            return {"status": "unconfirmed", "message": "Clicked Connect, but couldn't confirm the request was sent"}
         
-        browser_mgr.saveCookies()
         logger.info(f"Sent connection request to {request.profileLink}")
         return {"status": "ok", "message": "Connection request sent"}
     
@@ -217,23 +408,31 @@ async def sendConnect(request: ConnectProfile):
         logger.error(f"Failed to connect: {str(e)}")
         raise HTTPException(status_code=400, detail="Couldn't send connection request")
 
-@app.post("/check_connection")
-async def checkAndMessage(request: SendMessage):
+@app.post("/connect")
+async def sendConnect(request: ConnectProfile):
+    mgr = await pool.acquire()
+    try:
+        return await runSync(connectSync, mgr, request)
+    finally:
+        pool.release(mgr)
+
+def messageSync(browser_mgr, request):
     # Check connection and send message
     try:
-        if not browser_mgr.browser:
+        if not browser_mgr.browser or not browser_mgr.logged_in:
             raise HTTPException(status_code=400, detail="Login required!")
         
-        browser_mgr.browser.get(request.profileLink)
+        driver = browser_mgr.browser
+        openPage(driver, request.profileLink)
         
-        if checkIfConnected(browser_mgr.browser):
-            message_btn = waitForElement(browser_mgr.browser, By.XPATH, "//button[contains(text(), 'Message')]")
-            ActionChains(browser_mgr.browser).move_to_element(message_btn).click().perform()
+        if checkIfConnected(driver):
+            message_btn = waitForElement(driver, By.CSS_SELECTOR, "button[aria-label^='Message']")
+            clickElement(driver, message_btn)
             
-            message_box = waitForElement(browser_mgr.browser, By.XPATH, "//div[@role='textbox']")
+            message_box = waitForElement(driver, By.CSS_SELECTOR, "div[role='textbox']")
             message_box.send_keys(request.messageText)
             
-            send_btn = waitForElement(browser_mgr.browser, By.XPATH, "//button[contains(text(), 'Send')]")
+            send_btn = waitForElement(driver, By.XPATH, "//button[contains(text(), 'Send')]")
             send_btn.click()
             
             logger.info(f"Sent message to {request.profileLink}")
@@ -246,17 +445,34 @@ async def checkAndMessage(request: SendMessage):
         logger.error(f"Message sending failed: {str(e)}")
         raise HTTPException(status_code=400, detail="Something went wrong with messaging")
 
-@app.get("/close")
-async def closeBrowser():
-    # Shut down the browser
+@app.post("/check_connection")
+async def checkAndMessage(request: SendMessage):
+    mgr = await pool.acquire()
+    try:
+        return await runSync(messageSync, mgr, request)
+    finally:
+        pool.release(mgr)
+
+def closeSync(managers):
+    # Shut down all the browsers
     try:
-        browser_mgr.shutdown()
+        for mgr in managers:
+            mgr.shutdown()
         logger.info("All closed up!")
         return {"status": "ok", "message": "Browser session closed"}
     except Exception as e:
         logger.error(f"Shutdown failed: {str(e)}")
         raise HTTPException(status_code=500, detail="Couldn't close the browser")
 
+@app.get("/close")
+async def closeBrowser():
+    managers = await pool.acquireAll()
+    try:
+        return await runSync(closeSync, managers)
+    finally:
+        for mgr in managers:
+            pool.release(mgr)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file